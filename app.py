@@ -1,93 +1,173 @@
-import streamlit as st
-from streamlit_mic_recorder import mic_recorder
-from faster_whisper import WhisperModel
-import tempfile
-from fpdf import FPDF
-import requests
 import os
+import queue
+import time
+
+import streamlit as st
 from dotenv import load_dotenv
 
-# Load Mistral API Key
+# Load settings such as the Mistral API key before the modules below read them
 load_dotenv()
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 
-# Load Whisper model
-model = WhisperModel("tiny", compute_type="int8")
+from correct import CorrectionChunker, collect_corrections, submit_correction, warm_up_mistral
+from report import build_pdf, interpret_similarity, jaccard_similarity
+from transcribe import LIVE_WINDOW_CHARS, MODELS, LiveTranscriber, get_model, transcribe
 
-def jaccard_similarity(text1, text2):
-    """Calculate Jaccard similarity between two texts"""
-    # Convert to lowercase and split into words
-    words1 = set(text1.lower().split())
-    words2 = set(text2.lower().split())
-    
-    # Calculate intersection and union
-    intersection = words1.intersection(words2)
-    union = words1.union(words2)
-    
-    # Handle empty texts
-    if len(union) == 0:
-        return 1.0 if len(words1) == 0 and len(words2) == 0 else 0.0
-    
-    return len(intersection) / len(union)
+# "mic_recorder" records a clip and transcribes it after Stop; "webrtc"
+# streams the microphone and transcribes live. Only the chosen one is imported
+RECORDER = os.getenv("RECORDER", "mic_recorder")
+
+# How often a rerun checks on corrections still in flight
+CORRECTION_POLL_SECONDS = 0.25
+
+def live_transcription(model):
+    """Transcribe the WebRTC stream while recording; return the final text"""
+    from streamlit_webrtc import WebRtcMode, webrtc_streamer
+
+    ctx = webrtc_streamer(
+        key="live",
+        mode=WebRtcMode.SENDONLY,
+        audio_receiver_size=1024,
+        media_stream_constraints={"video": False, "audio": True},
+    )
+    live_box = st.empty()
+
+    if ctx.state.playing:
+        streamer = st.session_state.setdefault("live", LiveTranscriber(model))
+        while ctx.audio_receiver:
+            try:
+                frames = ctx.audio_receiver.get_frames(timeout=1)
+            except queue.Empty:
+                continue
+            streamer.insert_frames(frames)
+            if streamer.ready():
+                streamer.process()
+                tentative = streamer.tentative()
+                live_box.markdown(
+                    f"{streamer.recent_text()} *{tentative}*" if tentative else streamer.recent_text()
+                )
+        return None
 
-st.set_page_config(page_title="Live Audio Transcriber", layout="centered")
-st.title("🎤 Live Audio Transcriber with Mistral Correction")
+    # Recording stopped: flush the last audio, once
+    if "live" in st.session_state:
+        return st.session_state.pop("live").finish() or None
+    return None
 
-# Recorder UI
-audio = mic_recorder(start_prompt="🔴 Transcribe", stop_prompt="⏹ Stop", key="recorder")
+def recorded_transcription(model):
+    """Transcribe a new mic_recorder clip; returns (segment texts, clip id)"""
+    from streamlit_mic_recorder import mic_recorder
+
+    audio = mic_recorder(start_prompt="🔴 Transcribe", stop_prompt="⏹ Stop", key="recorder")
+
+    # The recorder keeps returning its last clip; only transcribe it once
+    if not audio:
+        return None, None
+    audio_id = hash(audio["bytes"])
+    if audio_id == st.session_state.get("last_audio_id"):
+        return None, None
 
-if audio:
     st.info("⏳ Transcribing...")
+    return transcribe(model, audio["bytes"]), audio_id
+
+def show_results(texts, audio_id=None):
+    """Transcribe, start the Mistral correction and show its progress
+
+    audio_id marks the clip as handled only once its correction is under
+    way; a rerun that interrupts the transcription transcribes it again.
+    """
+    progress = st.empty()
+    with progress.container():
+        st.subheader("📝 Raw Transcription")
+        raw_box = st.empty()
+
+    # Correct using Mistral, chunk by chunk as Whisper finishes sentences
+    chunker = CorrectionChunker()
+    done, jobs = [], []
+    recent = ""
+    for text in texts:
+        done.append(text)
+        recent = (recent + " " + text)[-LIVE_WINDOW_CHARS:]
+        raw_box.markdown(recent + " ▌")
+        jobs.extend(submit_correction(chunk) for chunk in chunker.add(text))
+    correct = chunker.worth_correcting()
+    jobs.extend(submit_correction(chunk, correct) for chunk in chunker.flush())
+    progress.empty()
+
+    st.session_state.correction = {
+        "full_text": " ".join(done),
+        "jobs": jobs,
+        "pieces": [[] for _ in jobs],
+        "finished": [False for _ in jobs],
+    }
+    if audio_id is not None:
+        st.session_state.last_audio_id = audio_id
+    show_correction()
+
+def show_correction():
+    """Show the correction in flight, polling it on reruns until it is finished
 
-    # Save audio temporarily
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmpfile:
-        tmpfile.write(audio["bytes"])
-        audio_path = tmpfile.name
+    The script never blocks on Mistral, so widgets stay responsive while the
+    corrected text streams in.
+    """
+    state = st.session_state.correction
+    full_text, jobs = state["full_text"], state["jobs"]
+    for i, (_, deltas, _) in enumerate(jobs):
+        while not state["finished"][i]:
+            try:
+                delta = deltas.get_nowait()
+            except queue.Empty:
+                break
+            if delta is None:
+                state["finished"][i] = True
+            else:
+                state["pieces"][i].append(delta)
 
-    # Transcribe using Whisper
-    segments, _ = model.transcribe(audio_path)
-    full_text = " ".join([s.text for s in segments])
     st.subheader("📝 Raw Transcription")
     st.text_area("Transcript", full_text, height=200)
+    st.subheader("✅ Final Corrected Transcript")
 
-    # Correct using Mistral
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "mistral-tiny",
-        "messages": [
-            {"role": "system", "content": "Correct transcription errors and grammar."},
-            {"role": "user", "content": full_text}
-        ],
-        "temperature": 0.3
-    }
+    if not all(state["finished"]) or not all(job.done() for _, _, job in jobs):
+        st.markdown(" ".join("".join(pieces) for pieces in state["pieces"]) + " ▌")
+        st.status("✨ Polishing with Mistral...", state="running")
+        time.sleep(CORRECTION_POLL_SECONDS)
+        st.rerun()
 
-    try:
-        res = requests.post("https://api.mistral.ai/v1/chat/completions", headers=headers, json=payload)
-        res.raise_for_status()
-        corrected = res.json()["choices"][0]["message"]["content"]
-    except Exception as e:
+    del st.session_state.correction
+    corrected, failed = collect_corrections(jobs)
+    st.text_area("Corrected Transcript", corrected, height=200)
+    if failed:
         st.error("❌ Mistral correction failed. Showing raw transcript.")
-        corrected = full_text
 
+    # Later reruns show this result without transcribing or correcting again
+    st.session_state.result = (full_text, corrected)
+    show_analysis(full_text, corrected)
+
+def show_saved_results(full_text, corrected):
+    """Show a previously computed result"""
+    st.subheader("📝 Raw Transcription")
+    st.text_area("Transcript", full_text, height=200)
     st.subheader("✅ Final Corrected Transcript")
     st.text_area("Corrected Transcript", corrected, height=200)
+    show_analysis(full_text, corrected)
+
+def _get_or_build(name, key, builder):
+    """Value stored in session_state under name, rebuilt only when key changes"""
+    cached = st.session_state.get(name)
+    if cached is None or cached[0] != key:
+        cached = (key, builder())
+        st.session_state[name] = cached
+    return cached[1]
+
+def show_analysis(full_text, corrected):
+    """Show the similarity analysis and the PDF download"""
+    # Both are rebuilt only when the transcripts change, not on every rerun
+    key = hash((full_text, corrected))
 
     # Calculate and display Jaccard Similarity
-    similarity_score = jaccard_similarity(full_text, corrected)
+    similarity_score = _get_or_build(
+        "similarity_score", key, lambda: jaccard_similarity(full_text, corrected)
+    )
     
-    # Color-code the similarity score
-    if similarity_score >= 0.8:
-        color = "green"
-        interpretation = "Very High - Mistral correction may not be necessary"
-    elif similarity_score >= 0.6:
-        color = "orange"
-        interpretation = "Moderate - Some benefit from Mistral correction"
-    else:
-        color = "red"
-        interpretation = "Low - Mistral correction is beneficial"
+    color, interpretation = interpret_similarity(similarity_score)
     
     st.subheader("📊 Transcript Analysis")
     col1, col2 = st.columns(2)
@@ -102,59 +182,38 @@ if audio:
     with col2:
         st.markdown(f"**Interpretation:** :{color}[{interpretation}]")
 
-    # Generate PDF
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    
-    # Title
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, "Audio Transcription Report", ln=True, align='C')
-    pdf.ln(10)
-    
-    # Similarity score
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, f"Jaccard Similarity Score: {similarity_score:.3f}", ln=True)
-    pdf.cell(0, 10, f"Interpretation: {interpretation}", ln=True)
-    pdf.ln(10)
-    
-    # Original transcript
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Original Transcript:", ln=True)
-    pdf.ln(5)
-    pdf.set_font("Arial", size=11)
-    for line in full_text.split("\n"):
-        if line.strip():  # Only add non-empty lines
-            # Encode text to handle special characters
-            try:
-                pdf.multi_cell(0, 8, line.encode('latin-1', 'replace').decode('latin-1'))
-            except:
-                # Fallback for problematic characters
-                pdf.multi_cell(0, 8, line.encode('ascii', 'ignore').decode('ascii'))
-    
-    pdf.ln(10)
-    
-    # Corrected transcript
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Corrected Transcript:", ln=True)
-    pdf.ln(5)
-    pdf.set_font("Arial", size=11)
-    for line in corrected.split("\n"):
-        if line.strip():  # Only add non-empty lines
-            # Encode text to handle special characters
-            try:
-                pdf.multi_cell(0, 8, line.encode('latin-1', 'replace').decode('latin-1'))
-            except:
-                # Fallback for problematic characters
-                pdf.multi_cell(0, 8, line.encode('ascii', 'ignore').decode('ascii'))
-
-    # Save PDF to bytes
-    pdf_output = pdf.output(dest='S').encode('latin-1')
-    
     # Provide download button
     st.download_button(
         label="📄 Download Transcript as PDF",
-        data=pdf_output,
+        data=_get_or_build(
+            "pdf_bytes", key, lambda: build_pdf(full_text, corrected, similarity_score)
+        ),
         file_name="transcript.pdf",
         mime="application/pdf"
     )
+
+def main():
+    st.set_page_config(page_title="Live Audio Transcriber", layout="centered")
+    st.title("🎤 Live Audio Transcriber with Mistral Correction")
+
+    # Load Whisper model
+    model_label = st.sidebar.selectbox("Language", list(MODELS))
+    model = get_model(MODELS[model_label])
+    warm_up_mistral()
+
+    # Recorder UI
+    if RECORDER == "webrtc":
+        live_text = live_transcription(model)
+        texts, audio_id = ([live_text] if live_text else None), None
+    else:
+        texts, audio_id = recorded_transcription(model)
+
+    if texts is not None:
+        show_results(texts, audio_id)
+    elif "correction" in st.session_state:
+        show_correction()
+    elif "result" in st.session_state:
+        show_saved_results(*st.session_state.result)
+
+if __name__ == "__main__":
+    main()
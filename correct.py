@@ -0,0 +1,276 @@
+"""Transcript correction with Mistral, streamed from background threads"""
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import orjson
+import requests
+import streamlit as st
+
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+
+MISTRAL_URL = "https://api.mistral.ai/v1/chat/completions"
+
+# mistral-tiny is a deprecated alias; a small model is plenty for grammar fixes
+MISTRAL_MODEL = os.getenv("MISTRAL_CORRECTION_MODEL", "ministral-3b-latest")
+
+# Correction requests in flight at once, across all sessions; each worker gets
+# its own pooled keep-alive connection
+MISTRAL_WORKERS = 4
+
+# Finished sentences are sent for correction once this many words have piled
+# up, so Mistral works on early text while Whisper is still decoding the rest
+# and long transcripts are corrected in parallel. Runs of words without
+# sentence punctuation are cut into pieces of at most twice this length
+CORRECTION_CHUNK_WORDS = 100
+
+# Latin and full-width (CJK) sentence terminators; no space follows the latter
+FULL_WIDTH_ENDINGS = ("。", "？", "！")
+SENTENCE_ENDINGS = (".", "?", "!") + FULL_WIDTH_ENDINGS
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|(?<=[。？！])")
+
+# Identical chunks reuse their correction for this long instead of calling Mistral
+CORRECTION_TTL_SECONDS = 3600
+
+# Corrections kept for reuse; the least recently used are dropped first
+CORRECTION_CACHE_SIZE = 256
+
+# Transcripts shorter than this many characters are left as they are rather
+# than sent to Mistral; characters, since not every script separates words
+MIN_CORRECTION_CHARS = 20
+
+@st.cache_resource
+def _mistral_session():
+    """Keep-alive HTTPS session to the Mistral API, shared across reruns"""
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json"
+    })
+    # One pooled connection per correction worker
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MISTRAL_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def _executor():
+    """Worker threads for Mistral requests, shared across reruns"""
+    return ThreadPoolExecutor(max_workers=MISTRAL_WORKERS)
+
+@st.cache_resource
+def _correction_cache():
+    """Corrections shared across sessions, as ({chunk digest: (time, corrected)}, lock)"""
+    return OrderedDict(), threading.Lock()
+
+def _cached_correction(digest):
+    """Correction stored for digest within the TTL, or None"""
+    cache, lock = _correction_cache()
+    with lock:
+        cached = cache.get(digest)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= CORRECTION_TTL_SECONDS:
+            del cache[digest]
+            return None
+        cache.move_to_end(digest)
+        return cached[1]
+
+def _store_correction(digest, corrected):
+    cache, lock = _correction_cache()
+    with lock:
+        cache[digest] = (time.monotonic(), corrected)
+        cache.move_to_end(digest)
+        while len(cache) > CORRECTION_CACHE_SIZE:
+            cache.popitem(last=False)
+
+@st.cache_resource
+def _in_flight():
+    """Corrections currently running, as ({chunk digest: future}, lock)"""
+    return {}, threading.Lock()
+
+def _open_connection(session):
+    try:
+        session.head(MISTRAL_URL, timeout=5)
+    except requests.RequestException:
+        pass
+
+@st.cache_resource
+def warm_up_mistral():
+    """Open the TLS connection on a worker thread, once per process
+
+    The first correction then reuses it instead of paying the handshake,
+    and the script thread never waits on it.
+    """
+    return _executor().submit(_open_connection, _mistral_session())
+
+def _digest(text):
+    return hashlib.blake2b(text.encode()).hexdigest()
+
+def stream_correction(session, text):
+    """Yield Mistral's correction of text piece by piece as it is generated"""
+    payload = {
+        "model": MISTRAL_MODEL,
+        "messages": [
+            {"role": "system", "content": "Correct transcription errors and grammar."},
+            {"role": "user", "content": text}
+        ],
+        "temperature": 0.3,
+        # A correction is about as long as its input; stop runaway explanations.
+        # Sized by characters, since words are not space-separated in every
+        # script and no script takes much more than a token per character
+        "max_tokens": len(text) + 64,
+        "stream": True
+    }
+    # Content-Type is set on the session, so the orjson bytes can go out as is
+    with session.post(MISTRAL_URL, data=orjson.dumps(payload), stream=True, timeout=30) as res:
+        res.raise_for_status()
+        # Server-sent events: one "data: {json}" line per chunk, then "data: [DONE]"
+        for line in res.iter_lines():
+            if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                continue
+            choice = orjson.loads(line[6:])["choices"][0]
+            delta = choice["delta"].get("content")
+            if delta:
+                yield delta
+            if choice.get("finish_reason") == "length":
+                # Cut off at max_tokens; the caller keeps the raw text instead
+                raise RuntimeError("Mistral correction was truncated")
+
+def correct_transcript(session, text, deltas):
+    """Correct text with Mistral, forwarding each streamed piece to deltas"""
+    # Nothing for Mistral to fix in text without any letters
+    if not any(c.isalpha() for c in text):
+        deltas.put(text)
+        deltas.put(None)
+        return text
+
+    pieces = []
+    try:
+        for delta in stream_correction(session, text):
+            pieces.append(delta)
+            deltas.put(delta)
+    finally:
+        # Always tell the reader this chunk is finished, even on failure
+        deltas.put(None)
+    # Only real Mistral output is cached; pass-through text and cache hits are not
+    corrected = "".join(pieces)
+    _store_correction(_digest(text), corrected)
+    return corrected
+
+def _finished_job(chunk, corrected):
+    """A correction job that is already done, for text that needs no request"""
+    deltas = queue.SimpleQueue()
+    deltas.put(corrected)
+    deltas.put(None)
+    future = Future()
+    future.set_result(corrected)
+    return chunk, deltas, future
+
+def submit_correction(chunk, correct=True):
+    """Start correcting chunk in the background; returns (chunk, deltas, future)
+
+    With correct=False the chunk is passed through as it is.
+    """
+    if not correct:
+        return _finished_job(chunk, chunk)
+    digest = _digest(chunk)
+    cached = _cached_correction(digest)
+    if cached is not None:
+        return _finished_job(chunk, cached)
+
+    deltas = queue.SimpleQueue()
+    # Sessions correcting the same chunk at the same time share one request;
+    # the executor's size already caps how many requests are in flight
+    session = _mistral_session()
+    in_flight, lock = _in_flight()
+    with lock:
+        future = in_flight.get(digest)
+        if future is None:
+            future = _executor().submit(correct_transcript, session, chunk, deltas)
+            in_flight[digest] = future
+            future.add_done_callback(lambda _: in_flight.pop(digest, None))
+            return chunk, deltas, future
+    future.add_done_callback(lambda f: _forward_result(f, deltas))
+    return chunk, deltas, future
+
+class CorrectionChunker:
+    """Cuts streamed transcript text into chunks of whole sentences"""
+
+    def __init__(self):
+        self.sentences = []
+        self.words = 0
+        self.total_chars = 0
+
+    def add(self, text):
+        """Add a piece of transcript; returns the chunks it completed"""
+        chunks = []
+        for sentence in SENTENCE_END.split(text.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            self.total_chars += len(sentence)
+            words = sentence.split()
+            # An over-long run without punctuation is cut mid-sentence
+            while self.words + len(words) > 2 * CORRECTION_CHUNK_WORDS:
+                room = 2 * CORRECTION_CHUNK_WORDS - self.words
+                self._append(words[:room])
+                words = words[room:]
+                chunks.append(self._cut())
+            if not words:
+                continue
+            self._append(words)
+            if sentence.endswith(SENTENCE_ENDINGS) and self.words >= CORRECTION_CHUNK_WORDS:
+                chunks.append(self._cut())
+        return chunks
+
+    def worth_correcting(self):
+        """Whether the transcript so far is long enough to send to Mistral
+
+        Judged on the whole transcript, so a short last chunk of a long one
+        is still corrected.
+        """
+        return self.total_chars >= MIN_CORRECTION_CHARS
+
+    def flush(self):
+        """Return the remaining text as a last chunk, if there is any"""
+        return [self._cut()] if self.sentences else []
+
+    def _append(self, words):
+        self.sentences.append(" ".join(words))
+        self.words += len(words)
+
+    def _cut(self):
+        chunk = ""
+        for sentence in self.sentences:
+            if chunk and not chunk.endswith(FULL_WIDTH_ENDINGS):
+                chunk += " "
+            chunk += sentence
+        self.sentences = []
+        self.words = 0
+        return chunk
+
+def _forward_result(future, deltas):
+    """Pass a shared correction to another reader as one piece"""
+    if future.exception() is None:
+        deltas.put(future.result())
+    deltas.put(None)
+
+def collect_corrections(jobs):
+    """Join finished correction jobs; returns (corrected, failed)
+
+    Chunks whose correction failed keep their raw text.
+    """
+    corrections = []
+    failed = False
+    for chunk, _, job in jobs:
+        try:
+            corrections.append(job.result())
+        except Exception:
+            failed = True
+            corrections.append(chunk)
+    return " ".join(corrections), failed
@@ -0,0 +1,61 @@
+"""Transcript comparison and the PDF report"""
+import html
+
+import numpy as np
+import streamlit as st
+from fpdf import FPDF
+
+def _tokenize(text):
+    """Sorted unique 64-bit hashes of the lowercased words in text"""
+    words = text.lower().split()
+    return np.unique(np.fromiter((hash(w) for w in words), dtype=np.int64, count=len(words)))
+
+@st.cache_data(show_spinner=False)
+def jaccard_similarity(text1, text2):
+    """Calculate Jaccard similarity between two texts"""
+    words1 = _tokenize(text1)
+    words2 = _tokenize(text2)
+
+    # Handle empty texts
+    if not words1.size or not words2.size:
+        return 1.0 if words1.size == words2.size else 0.0
+
+    intersection = np.intersect1d(words1, words2, assume_unique=True).size
+    return float(intersection / (words1.size + words2.size - intersection))
+
+def pdf_text(text):
+    """Escape text as report HTML that the built-in latin-1 PDF fonts can render"""
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return "<br>".join(html.escape(line) for line in text.split("\n") if line.strip())
+
+def interpret_similarity(similarity_score):
+    """Color and interpretation for a Jaccard similarity score"""
+    # Color-code the similarity score
+    if similarity_score >= 0.8:
+        return "green", "Very High - Mistral correction may not be necessary"
+    elif similarity_score >= 0.6:
+        return "orange", "Moderate - Some benefit from Mistral correction"
+    else:
+        return "red", "Low - Mistral correction is beneficial"
+
+@st.cache_data(show_spinner=False)
+def build_pdf(full_text, corrected, similarity_score):
+    """Render the transcription report as PDF bytes"""
+    _, interpretation = interpret_similarity(similarity_score)
+
+    # One HTML layout pass instead of a cell per heading and paragraph
+    report = (
+        '<h1 align="center">Audio Transcription Report</h1>'
+        f"<p><b>Jaccard Similarity Score: {similarity_score:.3f}<br>"
+        f"Interpretation: {interpretation}</b></p>"
+        f"<h2>Original Transcript:</h2><p>{pdf_text(full_text)}</p>"
+        f"<h2>Corrected Transcript:</h2><p>{pdf_text(corrected)}</p>"
+    )
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=11)
+    pdf.write_html(report)
+
+    # Save PDF to bytes
+    return bytes(pdf.output())
@@ -0,0 +1,325 @@
+"""Whisper transcription: model loading, recorded clips and live streaming"""
+import io
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import av
+import ctranslate2
+import numpy as np
+import streamlit as st
+from faster_whisper import WhisperModel, decode_audio
+
+# "ctranslate2" (faster-whisper) or "openvino" (optimum-intel, CPU only)
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "ctranslate2")
+
+# CPU compute types to benchmark at load time, preferred first on a tie. Pure
+# int8 can lose to int8_float32 at batch size 1 on CPUs without VNNI, so the
+# fastest one is measured rather than assumed; GPUs always use float16
+CPU_COMPUTE_TYPES = ["int8_bfloat16", "int8_float32", "int8"]
+
+# Concurrent transcriptions per model; CPU threads are split between them, so
+# the default gives a single session the whole machine
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+
+# CPUs this process may run on; the affinity mask honours container and
+# taskset limits, unlike cpu_count
+CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+CPU_THREADS = max(1, CPUS // WHISPER_WORKERS)
+
+SAMPLE_RATE = 16000
+
+# Live mode re-transcribes the rolling buffer after every LIVE_STEP_SECONDS of
+# new audio; committed audio is trimmed once the buffer passes
+# LIVE_TRIM_SECONDS. A pass never sees more than LIVE_BUFFER_SECONDS, Whisper's
+# 30 s window. When a pass takes longer than the step, the step grows to match
+# (up to LIVE_MAX_STEP_SECONDS, and never past the room left in the window) so
+# a backlog is transcribed in fewer, larger calls
+LIVE_STEP_SECONDS = 1.0
+LIVE_MAX_STEP_SECONDS = 10.0
+LIVE_TRIM_SECONDS = 15
+LIVE_BUFFER_SECONDS = 30
+
+# Only this much of a growing transcript is re-rendered while it is produced;
+# the full text is assembled once at the end
+LIVE_WINDOW_CHARS = 5000
+
+# Greedy decoding with Silero VAD, so silence is skipped rather than decoded
+FAST_DECODING = dict(
+    beam_size=1,
+    best_of=1,
+    temperature=0.0,
+    condition_on_previous_text=False,
+    without_timestamps=True,
+    vad_filter=True,
+    vad_parameters=dict(min_silence_duration_ms=500),
+)
+
+# Whisper checkpoints offered in the UI; distil-whisper is much faster for English
+MODELS = {
+    "English (distil-small.en)": "distil-small.en",
+    "English, more accurate (distil-medium.en)": "distil-medium.en",
+    "Multilingual (tiny)": "tiny",
+}
+
+# Hugging Face checkpoints behind the MODELS ids, for the OpenVINO backend
+OPENVINO_MODELS = {
+    "distil-small.en": "distil-whisper/distil-small.en",
+    "distil-medium.en": "distil-whisper/distil-medium.en",
+    "tiny": "openai/whisper-tiny",
+}
+
+class OpenVINOWhisper:
+    """Whisper exported to OpenVINO with int8 weights
+
+    Offers the subset of faster-whisper's transcribe() the app relies on, so
+    either backend can be returned by get_model().
+    """
+
+    def __init__(self, model_id):
+        from optimum.intel import OVModelForSpeechSeq2Seq, OVWeightQuantizationConfig
+        from transformers import AutoProcessor, pipeline
+
+        repo = OPENVINO_MODELS[model_id]
+        model = OVModelForSpeechSeq2Seq.from_pretrained(
+            repo, export=True, quantization_config=OVWeightQuantizationConfig(bits=8)
+        )
+        processor = AutoProcessor.from_pretrained(repo)
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
+        )
+
+    def transcribe(self, audio, word_timestamps=False, **options):
+        """Transcribe 16 kHz float32 audio; decoding options are not supported"""
+        result = self.pipe(
+            {"raw": audio, "sampling_rate": SAMPLE_RATE},
+            chunk_length_s=30,
+            return_timestamps="word" if word_timestamps else True,
+        )
+        chunks = [
+            SimpleNamespace(start=start, end=start if end is None else end, text=chunk["text"])
+            for chunk in result["chunks"]
+            for start, end in [chunk["timestamp"]]
+        ]
+        if not word_timestamps:
+            return iter(chunks), None
+        words = [SimpleNamespace(start=c.start, end=c.end, word=c.text) for c in chunks]
+        segment = SimpleNamespace(
+            start=words[0].start if words else 0.0,
+            end=words[-1].end if words else 0.0,
+            text=result["text"],
+            words=words,
+        )
+        return iter([segment]), None
+
+def pick_device():
+    """Use the GPU when CTranslate2 can see one"""
+    return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+def _create_model(model_id, device, compute_type):
+    return WhisperModel(
+        model_id,
+        device=device,
+        compute_type=compute_type,
+        cpu_threads=CPU_THREADS,
+        num_workers=WHISPER_WORKERS,
+    )
+
+# Timed runs per compute type after the warm-up; the fastest one counts, so a
+# single noisy run does not decide the choice
+BENCHMARK_RUNS = 3
+
+def _time_transcription(model, runs=1):
+    """Best seconds to transcribe one second of silence, after a warm-up run"""
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    timings = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        segments, _ = model.transcribe(silence, beam_size=1)
+        list(segments)
+        timings.append(time.perf_counter() - start)
+    return min(timings[1:])
+
+@st.cache_resource
+def get_model(model_id):
+    """Load a Whisper model once per process and share it across reruns
+
+    The returned model has already transcribed a short clip, so the first
+    recording hits warm kernels.
+    """
+    if WHISPER_BACKEND == "openvino":
+        model = OpenVINOWhisper(model_id)
+        _time_transcription(model)
+        return model
+
+    device = pick_device()
+    if device == "cuda":
+        model = _create_model(model_id, device, "float16")
+        _time_transcription(model)
+        return model
+
+    # Keep whichever supported CPU compute type transcribes fastest here
+    supported = ctranslate2.get_supported_compute_types("cpu")
+    best_time, best_model = None, None
+    for compute_type in CPU_COMPUTE_TYPES:
+        if compute_type not in supported:
+            continue
+        model = _create_model(model_id, device, compute_type)
+        elapsed = _time_transcription(model, BENCHMARK_RUNS)
+        if best_time is None or elapsed < best_time:
+            best_time, best_model = elapsed, model
+        # Drop this reference before loading the next candidate; a loser is
+        # freed at once, so at most two copies of the weights are in memory
+        del model
+    if best_model is None:
+        best_model = _create_model(model_id, device, "default")
+        _time_transcription(best_model)
+    return best_model
+
+def transcribe(model, audio_bytes):
+    """Transcribe a recorded clip; yields the segment texts as they are decoded"""
+    # Decode the recording in memory to 16 kHz mono float32
+    samples = decode_audio(io.BytesIO(audio_bytes), sampling_rate=SAMPLE_RATE)
+    segments, _ = model.transcribe(samples, **FAST_DECODING)
+    return (segment.text for segment in segments)
+
+class LiveTranscriber:
+    """Streaming transcription of WebRTC audio with LocalAgreement-2
+
+    Incoming audio is appended to a rolling buffer that is re-transcribed on
+    every step. Words on which two consecutive hypotheses agree are committed
+    and never re-emitted; the rest is shown as tentative text.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        # Preallocated store; the rolling buffer is audio[:size]
+        self.audio = np.empty(2 * LIVE_BUFFER_SECONDS * SAMPLE_RATE, dtype=np.float32)
+        self.size = 0
+        self.buffer_start = 0.0  # stream time of audio[0], in seconds
+        self.new_samples = 0
+        self.step = LIVE_STEP_SECONDS
+        self.transcript = io.StringIO()  # committed text, written once
+        self.recent = ""  # last LIVE_WINDOW_CHARS of the committed text
+        self.committed = deque(maxlen=5)  # last committed (start, end, word) tuples
+        self.hypothesis = []  # uncommitted words from the last step
+
+    def insert_frames(self, frames):
+        """Append WebRTC audio frames, resampled to 16 kHz mono, to the buffer"""
+        for frame in frames:
+            for out in self.resampler.resample(frame):
+                pcm = out.to_ndarray().reshape(-1)
+                end = self.size + len(pcm)
+                if end > len(self.audio):
+                    self._grow(end)
+                # Scale int16 straight into the store, without a temporary array
+                np.multiply(pcm, 1 / 32768.0, out=self.audio[self.size:end], casting="unsafe")
+                self.size = end
+                self.new_samples += len(pcm)
+
+    def ready(self):
+        return self.new_samples >= self.step * SAMPLE_RATE
+
+    def process(self):
+        """Re-transcribe the buffer and commit the agreed prefix"""
+        # Audio past the window is left for the next pass
+        window = min(self.size, LIVE_BUFFER_SECONDS * SAMPLE_RATE)
+        self.new_samples = self.size - window
+        prompt = self.recent[-200:]
+        started = time.perf_counter()
+        segments, _ = self.model.transcribe(
+            self.audio[:window],
+            **{**FAST_DECODING, "condition_on_previous_text": True},
+            initial_prompt=prompt or None,
+            word_timestamps=True,
+        )
+        words = [
+            (self.buffer_start + w.start, self.buffer_start + w.end, w.word)
+            for segment in segments
+            for w in segment.words
+        ]
+        # Segments decode lazily, so the pass is only timed once they are consumed
+        elapsed = time.perf_counter() - started
+        words = self._drop_committed(words)
+
+        # LocalAgreement-2: commit the longest common prefix of the last two hypotheses
+        agreed = 0
+        for new, old in zip(words, self.hypothesis):
+            if _normalize(new[2]) != _normalize(old[2]):
+                break
+            agreed += 1
+        self._commit(words[:agreed])
+        self.hypothesis = words[agreed:]
+
+        duration = self.size / SAMPLE_RATE
+        if duration > LIVE_BUFFER_SECONDS - LIVE_STEP_SECONDS:
+            # Nothing settled within a full window; take the hypothesis as is
+            self._commit(self.hypothesis)
+            self.hypothesis = []
+            self._trim(self.buffer_start + window / SAMPLE_RATE)
+        elif duration > LIVE_TRIM_SECONDS and self.committed:
+            self._trim(self.committed[-1][1])
+
+        room = LIVE_BUFFER_SECONDS - self.size / SAMPLE_RATE
+        self.step = max(LIVE_STEP_SECONDS, min(elapsed, LIVE_MAX_STEP_SECONDS, room))
+
+    def finish(self):
+        """Transcribe the remaining audio, commit everything and return the text"""
+        # A pass covers at most one window, so a long backlog takes several
+        while self.new_samples:
+            self.process()
+        self._commit(self.hypothesis)
+        self.hypothesis = []
+        return self.text()
+
+    def text(self):
+        return self.transcript.getvalue().strip()
+
+    def recent_text(self):
+        return self.recent.strip()
+
+    def tentative(self):
+        return "".join(word for _, _, word in self.hypothesis).strip()
+
+    def _commit(self, words):
+        self.committed.extend(words)
+        text = "".join(word for _, _, word in words)
+        self.transcript.write(text)
+        self.recent = (self.recent + text)[-LIVE_WINDOW_CHARS:]
+
+    def _drop_committed(self, words):
+        """Remove words of the new hypothesis that repeat already committed audio"""
+        if not self.committed:
+            return words
+        last_end = self.committed[-1][1]
+        words = [w for w in words if w[0] > last_end - 0.1]
+        # The first new words may still duplicate the committed tail
+        for n in range(min(len(self.committed), len(words), 5), 0, -1):
+            tail = [_normalize(w[2]) for w in list(self.committed)[-n:]]
+            head = [_normalize(w[2]) for w in words[:n]]
+            if tail == head:
+                return words[n:]
+        return words
+
+    def _grow(self, size):
+        """Enlarge the store when a slow step let more audio pile up than it holds"""
+        audio = np.empty(max(size, 2 * len(self.audio)), dtype=np.float32)
+        audio[:self.size] = self.audio[:self.size]
+        self.audio = audio
+
+    def _trim(self, until):
+        """Drop buffered audio before stream time until"""
+        cut = min(int((until - self.buffer_start) * SAMPLE_RATE), self.size)
+        if cut > 0:
+            # Shift the kept audio to the front of the store in place
+            self.audio[:self.size - cut] = self.audio[cut:self.size]
+            self.size -= cut
+            self.buffer_start += cut / SAMPLE_RATE
+
+def _normalize(word):
+    return word.strip().lower().strip(".,?!")